@@ -16,7 +16,6 @@ from datetime import datetime
 from functools import wraps
 
 import six
-from dateutil import parser
 from dateutil.relativedelta import relativedelta
 from elasticsearch import VERSION as ES_VERSION
 from elasticsearch.helpers import bulk
@@ -24,7 +23,7 @@ from elasticsearch_dsl import Index, Search
 from invenio_search import current_search, current_search_client
 from invenio_search.utils import prefix_index
 
-from .utils import get_bucket_size, get_doctype
+from .utils import get_bucket_size, get_doctype, parse_timestamp
 
 SUPPORTED_INTERVALS = OrderedDict([
     ('hour', '%Y-%m-%dT%H'),
@@ -262,7 +261,7 @@ class StatAggregator(object):
         # indexed but the indices have not been refreshed yet.
         if len(result) == 0:
             return None
-        return parser.parse(result[0]['timestamp'])
+        return parse_timestamp(result[0]['timestamp'])
 
     @property
     def doc_type(self):
@@ -398,8 +397,10 @@ class StatAggregator(object):
         aggs_query = Search(
             using=self.client,
             index=self.index,
-            doc_type=self.doc_type
         ).extra(_source=False)
+        # NOTE: ES7 indices have a single mapping type, no need to filter it
+        if ES_VERSION[0] < 7:
+            aggs_query = aggs_query.doc_type(self.doc_type)
 
         range_args = {}
         if start_date:
@@ -15,14 +15,14 @@ from time import mktime
 
 import elasticsearch
 from counter_robots import is_machine, is_robot
-from dateutil import parser
 from flask import current_app
 from invenio_search import current_search_client
 from invenio_search.utils import prefix_index
 from pytz import utc
+from werkzeug.local import LocalProxy
 
 from .utils import get_anonymization_salt, get_doctype, get_geoip, \
-    obj_or_import_string
+    obj_or_import_string, parse_timestamp
 
 
 def anonymize_user(doc):
@@ -59,7 +59,7 @@ def anonymize_user(doc):
     # one hour. timeslice represents the hour of the day in which
     # the event has been generated and together with user info it determines
     # the 'User Session'
-    timestamp = parser.parse(doc.get('timestamp'))
+    timestamp = parse_timestamp(doc.get('timestamp'))
     timeslice = timestamp.strftime('%Y%m%d%H')
     salt = get_anonymization_salt(timestamp)
 
@@ -145,21 +145,33 @@ class EventsIndexer(object):
     """Default preprocessors ran on every event."""
 
     def __init__(self, queue, prefix='events', suffix='%Y-%m-%d', client=None,
-                 preprocessors=None, double_click_window=10):
+                 preprocessors=None, double_click_window=10, chunk_size=500,
+                 thread_count=4, max_chunk_bytes=10 * 1024 * 1024):
         """Initialize indexer.
 
         :param prefix: prefix appended to elasticsearch indices' name.
         :param suffix: suffix appended to elasticsearch indices' name.
         :param double_click_window: time window during which similar events are
-            deduplicated (counted as one occurence).
+            deduplicated (counted as one occurence). When the duplicates of a
+            time window are sent in different bulk requests, which run in
+            parallel, the event kept for that window is arbitrary.
         :param client: elasticsearch client.
         :param preprocessors: a list of functions which are called on every
             event before it is indexed. Each function should return the
             processed event. If it returns None, the event is filtered and
             won't be indexed.
+        :param chunk_size: number of events sent in one bulk request.
+        :param thread_count: number of threads sending bulk requests in
+            parallel.
+        :param max_chunk_bytes: maximum size in bytes of one bulk request.
         """
         self.queue = queue
-        self.client = client or current_search_client
+        client = client or current_search_client
+        # The bulk requests are sent from worker threads which have no
+        # application context, thus the client can't be a context proxy.
+        if isinstance(client, LocalProxy):
+            client = client._get_current_object()
+        self.client = client
         self.doctype = get_doctype(queue.routing_key)
         self.index = prefix_index('{0}-{1}'.format(
             prefix, self.queue.routing_key))
@@ -169,6 +181,9 @@ class EventsIndexer(object):
             obj_or_import_string(preproc) for preproc in preprocessors
         ] if preprocessors is not None else self.default_preprocessors
         self.double_click_window = double_click_window
+        self.chunk_size = chunk_size
+        self.thread_count = thread_count
+        self.max_chunk_bytes = max_chunk_bytes
 
     def actionsiter(self):
         """Iterator."""
@@ -180,7 +195,7 @@ class EventsIndexer(object):
                         break
                 if msg is None:
                     continue
-                ts = parser.parse(msg.get('timestamp'))
+                ts = parse_timestamp(msg.get('timestamp'))
                 suffix = ts.strftime(self.suffix)
                 # Truncate timestamp to keep only seconds. This is to improve
                 # elasticsearch performances.
@@ -205,10 +220,31 @@ class EventsIndexer(object):
                 current_app.logger.exception(u'Error while processing event')
 
     def run(self):
-        """Process events queue."""
-        return elasticsearch.helpers.bulk(
-            self.client,
-            self.actionsiter(),
-            stats_only=True,
-            chunk_size=50
-        )
+        """Process events queue.
+
+        :returns: tuple of the number of indexed and failed events.
+        """
+        app = current_app._get_current_object()
+
+        def actions():
+            # The actions are consumed from one of the bulk worker threads,
+            # which does not have access to the caller's application context.
+            with app.app_context():
+                for action in self.actionsiter():
+                    yield action
+
+        success, failed = 0, 0
+        for ok, info in elasticsearch.helpers.parallel_bulk(
+                self.client,
+                actions(),
+                chunk_size=self.chunk_size,
+                thread_count=self.thread_count,
+                max_chunk_bytes=self.max_chunk_bytes,
+                raise_on_error=False):
+            if ok:
+                success += 1
+            else:
+                failed += 1
+                current_app.logger.error(
+                    u'Error while indexing event: %s', info)
+        return success, failed
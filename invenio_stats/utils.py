@@ -12,9 +12,11 @@ from __future__ import absolute_import, print_function
 
 import os
 from base64 import b64encode
+from datetime import datetime
 from math import ceil
 
 import six
+from dateutil import parser
 from elasticsearch import VERSION as ES_VERSION
 from elasticsearch_dsl import Search
 from flask import current_app, request, session
@@ -53,6 +55,25 @@ def get_bucket_size(client, index, agg_field):
     return int(ceil(count + count * 0.1))
 
 
+ISO_TIMESTAMP_FORMATS = ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M:%S.%f')
+"""Formats produced by ``datetime.isoformat()`` for naive datetimes."""
+
+
+def parse_timestamp(value):
+    """Parse an event timestamp.
+
+    Timestamps generated with ``datetime.isoformat()`` are parsed with
+    ``datetime.strptime``, which is a lot faster than ``dateutil``'s generic
+    parser. Any other format falls back to ``dateutil``.
+    """
+    for fmt in ISO_TIMESTAMP_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    return parser.parse(value)
+
+
 def get_doctype(doc_type):
     """Configure doc_type value according to ES version."""
     return doc_type if ES_VERSION[0] < 7 else '_doc'
@@ -22,6 +22,7 @@ from copy import deepcopy
 # login_oauth2_user(valid, oauth) is included
 import invenio_oauth2server.views.server  # noqa
 import pytest
+from elasticsearch import Urllib3HttpConnection
 from flask import Flask, appcontext_pushed, g
 from flask.cli import ScriptInfo
 from flask_celeryext import FlaskCeleryExt
@@ -41,6 +42,7 @@ from invenio_queues.proxies import current_queues
 from invenio_records import InvenioRecords
 from invenio_records.api import Record
 from invenio_search import InvenioSearch, current_search, current_search_client
+from invenio_search.utils import build_alias_name
 from kombu import Exchange
 from mock import Mock, patch
 from six import BytesIO
@@ -161,7 +163,14 @@ def base_app(events_config, aggregations_config):
             'SQLALCHEMY_DATABASE_URI', 'sqlite://'),
         SQLALCHEMY_TRACK_MODIFICATIONS=True,
         # Bump the ES client timeout for slower environments (like Travis CI)
-        SEARCH_CLIENT_CONFIG={'timeout': 30, 'max_retries': 5},
+        # and the connection pool size for the parallel bulk indexing. The
+        # pool size is only used by the urllib3 connection class.
+        SEARCH_CLIENT_CONFIG={
+            'timeout': 30,
+            'max_retries': 5,
+            'maxsize': 25,
+            'connection_class': Urllib3HttpConnection,
+        },
         TESTING=True,
         OAUTH2SERVER_CLIENT_ID_SALT_LEN=64,
         OAUTH2SERVER_CLIENT_SECRET_SALT_LEN=60,
@@ -214,22 +223,79 @@ def db(app):
     db_.drop_all()
 
 
+TEST_INDICES_PATTERNS = [
+    'events-stats-file-download-*',
+    'stats-file-download-*',
+]
+"""Patterns of the indices which get the ``TEST_INDICES_TEMPLATE``."""
+
+TEST_INDICES_TEMPLATE = {
+    # Applied on top of the events and aggregations templates
+    'order': 1,
+    'settings': {
+        'index': {
+            'number_of_replicas': 0,
+            'refresh_interval': '-1',
+        },
+    },
+}
+"""Index settings for the test indices.
+
+The tests run against a single node and refresh the indices explicitly
+before searching them, thus replicas and periodic refreshes are disabled.
+"""
+
+
+@pytest.fixture(scope='session')
+def installed_templates():
+    """Keep track of the templates installed by the ``es`` fixture.
+
+    The installed templates are deleted at the end of the test session.
+    """
+    installed = {'names': []}
+    yield installed
+    for name in installed['names']:
+        installed['client'].indices.delete_template(name, ignore=[404])
+
+
 @pytest.fixture()
-def es(app):
+def es(app, installed_templates):
     """Provide elasticsearch access, create and clean indices.
 
     Don't create template so that the test or another fixture can modify the
     enabled events.
+
+    The templates are kept between tests and only reinstalled when the
+    enabled templates or the index prefix change, in which case only the
+    templates previously installed by this fixture are deleted. Only the
+    indices using the configured index prefix are deleted.
     """
-    current_search_client.indices.delete(index='*')
-    current_search_client.indices.delete_template('*')
+    client = current_search_client._get_current_object()
+    prefix = app.config.get('SEARCH_INDEX_PREFIX') or ''
+    indices = '{0}*'.format(prefix)
+    templates = (prefix, sorted(current_search.templates.items()))
+    client.indices.delete(index=indices)
     list(current_search.create())
-    list(current_search.put_templates())
+    if installed_templates.get('templates') != templates:
+        for name in installed_templates['names']:
+            client.indices.delete_template(name, ignore=[404])
+        list(current_search.put_templates())
+        installed_templates['client'] = client
+        installed_templates['names'] = [
+            build_alias_name(template, app=app)
+            for template in current_search.templates]
+        for pattern in TEST_INDICES_PATTERNS:
+            name = '{0}test-settings-{1}'.format(prefix, pattern[:-2])
+            client.indices.put_template(
+                name=name,
+                body=dict(TEST_INDICES_TEMPLATE,
+                          template='{0}{1}'.format(prefix, pattern)))
+            installed_templates['names'].append(name)
+        installed_templates['templates'] = templates
     try:
-        yield current_search_client
+        yield client
     finally:
-        current_search_client.indices.delete(index='*')
-        current_search_client.indices.delete_template('*')
+        client.indices.delete(index=indices)
 
 
 @pytest.fixture()
@@ -400,7 +466,8 @@ def mock_event_queue(app, mock_datetime, request_headers, objects,
     """Create a mock queue containing a few file download events."""
     mock_queue = Mock()
     mock_queue.routing_key = 'stats-file-download'
-    with patch('datetime.datetime', mock_datetime), \
+    with patch('invenio_stats.contrib.event_builders.datetime',
+               Mock(datetime=mock_datetime)), \
             app.test_request_context(headers=request_headers['user']):
         events = [
             build_file_unique_id(
@@ -466,7 +533,7 @@ def generate_events(app, file_number=5, event_number=100, robot_event_number=0,
         ],
         double_click_window=0
     ).run()
-    current_search.flush_and_refresh(index='*')
+    current_search_client.indices.refresh(index='events-stats-file-download-*')
 
 
 @pytest.fixture()
@@ -513,6 +580,17 @@ def get_deleted_docs(index):
         'deleted']
 
 
+_isoformat_cache = {}
+
+
+def _isoformat(timestamp):
+    """Format a timestamp tuple in ISO 8601, memoizing the result."""
+    if timestamp not in _isoformat_cache:
+        _isoformat_cache[timestamp] = \
+            datetime.datetime(*timestamp).isoformat()
+    return _isoformat_cache[timestamp]
+
+
 def _create_file_download_event(timestamp,
                                 bucket_id='B0000000000000000000000000000001',
                                 file_id='F0000000000000000000000000000001',
@@ -522,7 +600,7 @@ def _create_file_download_event(timestamp,
                                 user_id=None):
     """Create a file_download event content."""
     doc = dict(
-        timestamp=datetime.datetime(*timestamp).isoformat(),
+        timestamp=_isoformat(timestamp),
         # What:
         bucket_id=str(bucket_id),
         file_id=str(file_id),
@@ -534,6 +612,16 @@ def _create_file_download_event(timestamp,
     return build_file_unique_id(doc)
 
 
+def _create_file_download_events(timestamps, **kwargs):
+    """Create file_download events content, one for each timestamp.
+
+    The event content is built once and copied for every timestamp.
+    """
+    doc = _create_file_download_event(timestamps[0], **kwargs)
+    return [dict(doc, timestamp=_isoformat(timestamp))
+            for timestamp in timestamps]
+
+
 def _create_record_view_event(timestamp,
                               record_id='R0000000000000000000000000000001',
                               pid_type='recid',
@@ -542,7 +630,7 @@ def _create_record_view_event(timestamp,
                               user_id=None):
     """Create a file_download event content."""
     doc = dict(
-        timestamp=datetime.datetime(*timestamp).isoformat(),
+        timestamp=_isoformat(timestamp),
         # What:
         record_id=record_id,
         pid_type=pid_type,
@@ -11,7 +11,7 @@
 import datetime
 
 import pytest
-from conftest import _create_file_download_event
+from conftest import _create_file_download_events
 from elasticsearch_dsl import Index, Search
 from invenio_search import current_search
 from mock import patch
@@ -23,6 +23,13 @@ from invenio_stats.tasks import aggregate_events, process_events
 from invenio_stats.utils import get_doctype
 
 
+def _index_file_download_events(es, queue, timestamps):
+    """Index file download events sent through a mock queue."""
+    queue.consume.return_value = _create_file_download_events(timestamps)
+    EventsIndexer(queue).run()
+    es.indices.refresh(index='events-stats-file-download-*')
+
+
 def test_wrong_intervals(app, es):
     """Test aggregation with interval > index_interval."""
     with pytest.raises(ValueError):
@@ -71,48 +78,45 @@ def test_overwriting_aggregations(app, es, mock_event_queue):
             return cls(*cls.current_date)
 
     # Send some events
-    mock_event_queue.consume.return_value = [
-        _create_file_download_event(date) for date in
-        [(2017, 6, 1), (2017, 6, 2, 10)]
-    ]
-
-    indexer = EventsIndexer(mock_event_queue)
-    indexer.run()
-    current_search.flush_and_refresh(index='*')
+    _index_file_download_events(es, mock_event_queue,
+                                [(2017, 6, 1), (2017, 6, 2, 10)])
 
     # Aggregate events
     with patch('invenio_stats.aggregations.datetime', NewDate):
         aggregate_events(['file-download-agg'])
-    current_search.flush_and_refresh(index='*')
+    es.indices.refresh(index='stats-*')
 
     # Send new events, some on the last aggregated day and some far
     # in the future.
-    res = es.search(index='stats-file-download', version=True)
+    res = es.search(index='stats-file-download', version=True,
+                    body={'_source': ['file_id']})
     for hit in res['hits']['hits']:
         if 'file_id' in hit['_source'].keys():
             assert hit['_version'] == 1
 
-    mock_event_queue.consume.return_value = [
-        _create_file_download_event(date) for date in
-        [(2017, 6, 2, 15),  # second event on the same date
-         (2017, 7, 1)]
-    ]
-    indexer = EventsIndexer(mock_event_queue)
-    indexer.run()
-    current_search.flush_and_refresh(index='*')
+    _index_file_download_events(es, mock_event_queue,
+                                [(2017, 6, 2, 15),  # second event same date
+                                 (2017, 7, 1)])
 
     # Aggregate again. The aggregation should start from the last bookmark.
     NewDate.current_date = (2017, 7, 2)
     with patch('invenio_stats.aggregations.datetime', NewDate):
         aggregate_events(['file-download-agg'])
-    current_search.flush_and_refresh(index='*')
-    res = es.search(index='stats-file-download', version=True)
+    es.indices.refresh(index='stats-*')
+    # The aggregation id is made of the unique_id and the aggregated day
+    overwritten_id = 'B0000000000000000000000000000001_' \
+        'F0000000000000000000000000000001-2017-06-02'
+    hit = es.get(index='stats-file-download-2017-06',
+                 doc_type=get_doctype('file-download-day-aggregation'),
+                 id=overwritten_id, _source=['count'])
+    assert hit['_version'] == 2
+    assert hit['_source']['count'] == 2
+    res = es.search(index='stats-file-download', version=True, body={
+        'query': {'bool': {'must_not': {'ids': {'values': [overwritten_id]}}}},
+        '_source': False,
+    })
     for hit in res['hits']['hits']:
-        if hit['_source']['timestamp'] == '2017-06-02T00:00:00':
-            assert hit['_version'] == 2
-            assert hit['_source']['count'] == 2
-        else:
-            assert hit['_version'] == 1
+        assert hit['_version'] == 1
 
 
 def test_aggregation_without_events(app, es):
@@ -133,7 +137,8 @@ def test_aggregation_without_events(app, es):
     Index('events-stats-file-download-2017', using=es).create()
 
     # Wait for the index to be available
-    current_search.flush_and_refresh(index='*')
+    es.cluster.health(index='events-stats-file-download-2017',
+                      wait_for_status='yellow', timeout='5s')
 
     # Aggregate events
     StatAggregator(name='test-file-download',
@@ -150,14 +155,8 @@ def test_bookmark_removal(app, es, mock_event_queue):
     This simulates the scenario where aggregations have been created but the
     the bookmarks have not been set due to an error.
     """
-    mock_event_queue.consume.return_value = [
-        _create_file_download_event(date) for date in
-        [(2017, 6, 2, 15),  # second event on the same date
-         (2017, 7, 1)]
-    ]
-    indexer = EventsIndexer(mock_event_queue)
-    indexer.run()
-    current_search.flush_and_refresh(index='*')
+    _index_file_download_events(es, mock_event_queue,
+                                [(2017, 6, 2, 15), (2017, 7, 1)])
 
     def aggregate_and_check_version(expected_version):
         StatAggregator(
@@ -167,26 +166,21 @@ def test_bookmark_removal(app, es, mock_event_queue):
             event='file-download',
             query_modifiers=[],
         ).run()
-        current_search.flush_and_refresh(index='*')
+        es.indices.refresh(index='stats-*')
         res = es.search(
-            index='stats-file-download', version=True)
+            index='stats-file-download', version=True,
+            body={'_source': False})
         for hit in res['hits']['hits']:
             assert hit['_version'] == expected_version
 
     aggregate_and_check_version(1)
     aggregate_and_check_version(1)
     # Delete all bookmarks
-    bookmarks = Search(using=es, index='stats-bookmarks') \
-        .filter('term', aggregation_type='file-download-agg') \
-        .execute()
-
-    for bookmark in bookmarks:
-        es.delete(
-            index=bookmark.meta.index, id=bookmark.meta.id,
-            doc_type=get_doctype(bookmark.meta.doc_type)
-        )
-
-    current_search.flush_and_refresh(index='*')
+    es.delete_by_query(
+        index='stats-bookmarks',
+        body={'query': {'term': {'aggregation_type': 'file-download-agg'}}},
+        conflicts='proceed', refresh=True
+    )
     # the aggregations should have been overwritten
     aggregate_and_check_version(2)
 
@@ -200,16 +194,13 @@ def test_bookmark_removal(app, es, mock_event_queue):
 def test_date_range(app, es, event_queues, indexed_events):
     """Test date ranges."""
     aggregate_events(['file-download-agg'])
-    current_search.flush_and_refresh(index='*')
-    query = Search(using=es,
-                   index='stats-file-download')[0:30].sort('file_id')
-    results = query.execute()
-
-    total_count = 0
-    for result in results:
-        if 'file_id' in result:
-            total_count += result.count
-    assert total_count == 30
+    es.indices.refresh(index='stats-*')
+    res = es.search(index='stats-file-download', body={
+        'size': 0,
+        'query': {'exists': {'field': 'file_id'}},
+        'aggs': {'total': {'sum': {'field': 'count'}}},
+    })
+    assert res['aggregations']['total']['value'] == 30
 
 
 @pytest.mark.parametrize('indexed_events',
@@ -219,37 +210,48 @@ def test_date_range(app, es, event_queues, indexed_events):
                                start_date=datetime.date(2015, 1, 28),
                                end_date=datetime.date(2015, 1, 30))],
                          indirect=['indexed_events'])
-@pytest.mark.parametrize("with_robots", [(True), (False)])
-def test_filter_robots(app, es, event_queues, indexed_events, with_robots):
-    """Test the filter_robots query modifier."""
-    query_modifiers = []
-    if not with_robots:
-        query_modifiers = [filter_robots]
-    StatAggregator(name='file-download-agg',
-                   client=es,
-                   event='file-download',
-                   field='file_id',
-                   interval='day',
-                   query_modifiers=query_modifiers).run()
-    current_search.flush_and_refresh(index='*')
-    query = Search(using=es, index='stats-file-download')[0:30] \
-        .sort('file_id')
-    results = query.execute()
-    assert len(results) == 3
-    for result in results:
-        if 'file_id' in result:
-            assert result.count == (5 if with_robots else 2)
+def test_filter_robots(app, es, event_queues, indexed_events):
+    """Test the filter_robots query modifier.
+
+    The same indexed events are aggregated with and without the modifier,
+    deleting the aggregations and bookmarks in between.
+    """
+    # One aggregation per day for the single file
+    expected_aggregations = 3
+    for with_robots in (True, False):
+        query_modifiers = []
+        if not with_robots:
+            query_modifiers = [filter_robots]
+        stat_agg = StatAggregator(name='file-download-agg',
+                                  client=es,
+                                  event='file-download',
+                                  field='file_id',
+                                  interval='day',
+                                  query_modifiers=query_modifiers)
+        stat_agg.run()
+        es.indices.refresh(index='stats-*')
+        # Fetch one more document than expected to detect extra ones
+        res = es.search(index='stats-file-download', body={
+            'size': expected_aggregations + 1,
+            '_source': ['count', 'file_id'],
+        })
+        assert len(res['hits']['hits']) == expected_aggregations
+        for hit in res['hits']['hits']:
+            if 'file_id' in hit['_source']:
+                assert hit['_source']['count'] == (5 if with_robots else 2)
+        stat_agg.delete()
 
 
 def test_metric_aggregations(app, es, event_queues):
     """Test aggregation metrics."""
     current_stats.publish(
         'file-download',
-        [_create_file_download_event(date, user_id='1') for date in
-         [(2018, 1, 1, 12, 10), (2018, 1, 1, 12, 20), (2018, 1, 1, 12, 30),
-          (2018, 1, 1, 13, 10), (2018, 1, 1, 13, 20), (2018, 1, 1, 13, 30),
-          (2018, 1, 1, 14, 10), (2018, 1, 1, 14, 20), (2018, 1, 1, 14, 30),
-          (2018, 1, 1, 15, 10), (2018, 1, 1, 15, 20), (2018, 1, 1, 15, 30)]])
+        _create_file_download_events(
+            [(2018, 1, 1, 12, 10), (2018, 1, 1, 12, 20), (2018, 1, 1, 12, 30),
+             (2018, 1, 1, 13, 10), (2018, 1, 1, 13, 20), (2018, 1, 1, 13, 30),
+             (2018, 1, 1, 14, 10), (2018, 1, 1, 14, 20), (2018, 1, 1, 14, 30),
+             (2018, 1, 1, 15, 10), (2018, 1, 1, 15, 20), (2018, 1, 1, 15, 30)],
+            user_id='1'))
     process_events(['file-download'])
     current_search.flush_and_refresh(index='*')
 
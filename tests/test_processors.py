@@ -17,7 +17,7 @@ from elasticsearch import VERSION as ES_VERSION
 from elasticsearch_dsl import Search
 from helpers import get_queue_size
 from invenio_queues.proxies import current_queues
-from invenio_search import current_search
+from invenio_search import current_search, current_search_client
 from mock import patch
 
 from invenio_stats.contrib.event_builders import build_file_unique_id, \
@@ -193,10 +193,12 @@ def test_events_indexer_preprocessors(app, mock_event_queue):
     # Generate the events
     received_docs = []
 
-    def bulk(client, generator, *args, **kwargs):
+    def parallel_bulk(client, generator, *args, **kwargs):
         received_docs.extend(generator)
+        return iter([])
 
-    with patch('elasticsearch.helpers.bulk', side_effect=bulk):
+    with patch('elasticsearch.helpers.parallel_bulk',
+               side_effect=parallel_bulk):
         indexer.run()
 
     # Process the events as we expect them to be
@@ -226,8 +228,9 @@ def test_events_indexer_id_windowing(app, mock_event_queue):
     # Generated docs will be registered in this list
     received_docs = []
 
-    def bulk(client, generator, *args, **kwargs):
+    def parallel_bulk(client, generator, *args, **kwargs):
         received_docs.extend(generator)
+        return iter([])
 
     mock_event_queue.consume.return_value = [
         _create_file_download_event(date) for date in
@@ -240,7 +243,8 @@ def test_events_indexer_id_windowing(app, mock_event_queue):
         ]
     ]
 
-    with patch('elasticsearch.helpers.bulk', side_effect=bulk):
+    with patch('elasticsearch.helpers.parallel_bulk',
+               side_effect=parallel_bulk):
         indexer.run()
 
     assert len(received_docs) == 5
@@ -269,6 +273,28 @@ def test_double_clicks(app, mock_event_queue, es):
         assert res['hits']['total']['value'] == 2
 
 
+def test_double_clicks_parallel_bulk(app, es):
+    """Test double clicks sent in different parallel bulk requests."""
+    current_queues.declare()
+    current_stats.publish('file-download', [
+        _create_file_download_event(date) for date in
+        [(2000, 6, 1, 10, 0, 10),
+         (2000, 6, 1, 10, 0, 11),
+         (2000, 6, 1, 10, 0, 19),
+         (2000, 6, 1, 10, 0, 22)]])
+    queue = current_queues.queues['stats-file-download']
+    assert EventsIndexer(queue, chunk_size=1, thread_count=2).run() == (4, 0)
+    es.indices.refresh(index='events-stats-file-download-2000-06-01')
+    res = es.search(index='events-stats-file-download-2000-06-01')
+    timestamps = sorted(
+        hit['_source']['timestamp'] for hit in res['hits']['hits'])
+    # The kept event of a time window depends on which request ran last.
+    assert len(timestamps) == 2
+    assert timestamps[0] in ('2000-06-01T10:00:10', '2000-06-01T10:00:11',
+                             '2000-06-01T10:00:19')
+    assert timestamps[1] == '2000-06-01T10:00:22'
+
+
 def test_failing_processors(app, es, event_queues, caplog):
     """Test events that raise an exception when processed."""
     search = Search(using=es)
@@ -314,3 +340,36 @@ def test_failing_processors(app, es, event_queues, caplog):
     assert not es.indices.exists('events-stats-file-download-2018-01-02')
     assert search.index('events-stats-file-download-2018-01-03').count() == 1
     assert search.index('events-stats-file-download-2018-01-04').count() == 1
+
+
+def test_events_indexer_client(app, mock_event_queue):
+    """Check that EventsIndexer doesn't keep a context-bound client proxy."""
+    client = current_search_client._get_current_object()
+    assert EventsIndexer(mock_event_queue).client is client
+    indexer = EventsIndexer(mock_event_queue, client=current_search_client)
+    assert indexer.client is client
+
+
+def test_events_indexer_run(app, mock_event_queue, caplog):
+    """Check the EventsIndexer bulk options and indexing results."""
+    indexer = EventsIndexer(mock_event_queue, preprocessors=[],
+                            chunk_size=10, thread_count=2,
+                            max_chunk_bytes=1024)
+    error = {'index': {'_id': 'test-id', 'status': 400,
+                       'error': 'mocked-error'}}
+    bulk_kwargs = {}
+
+    def parallel_bulk(client, generator, *args, **kwargs):
+        bulk_kwargs.update(kwargs)
+        return iter([(True, {}), (False, error), (True, {})])
+
+    with patch('elasticsearch.helpers.parallel_bulk',
+               side_effect=parallel_bulk), caplog.at_level(logging.ERROR):
+        assert indexer.run() == (2, 1)
+
+    assert bulk_kwargs == dict(chunk_size=10, thread_count=2,
+                               max_chunk_bytes=1024, raise_on_error=False)
+    # Check that the rejected event was logged
+    error_logs = [r for r in caplog.records if r.levelno == logging.ERROR]
+    assert len(error_logs) == 1
+    assert 'mocked-error' in error_logs[0].getMessage()
@@ -8,9 +8,13 @@
 
 """Test utility functions."""
 
+from datetime import datetime
+
+from dateutil.tz import tzutc
 from mock import patch
 
-from invenio_stats.utils import get_geoip, get_user, obj_or_import_string
+from invenio_stats.utils import get_geoip, get_user, obj_or_import_string, \
+    parse_timestamp
 
 
 def myfunc():
@@ -42,3 +46,15 @@ def test_obj_or_import_string(app):
     """Test obj_or_import_string."""
     assert not obj_or_import_string(value=None)
     assert myfunc == obj_or_import_string(value=myfunc)
+
+
+def test_parse_timestamp():
+    """Test parse_timestamp."""
+    assert parse_timestamp('2018-01-01T12:10:30') == \
+        datetime(2018, 1, 1, 12, 10, 30)
+    assert parse_timestamp('2018-01-01T12:10:30.000123') == \
+        datetime(2018, 1, 1, 12, 10, 30, 123)
+    # Other formats are parsed by dateutil
+    assert parse_timestamp('2018-01-01') == datetime(2018, 1, 1)
+    assert parse_timestamp('2018-01-01T12:10:30Z') == \
+        datetime(2018, 1, 1, 12, 10, 30, tzinfo=tzutc())